@@ -1,8 +1,11 @@
-import json
+import sys
 import time
+from contextlib import nullcontext
+from types import MappingProxyType
 from typing import List
 import gradio as gr
 from gradio import ChatMessage
+import orjson
 from opentelemetry import trace
 
 from azure.ai.projects.models import (
@@ -14,100 +17,148 @@ from azure.ai.projects.models import (
     MessageDeltaChunk,
 )
 
+_loads = orjson.loads
+
+# Write streamed text to stdout once this many chars are pending (or on a newline)
+_STDOUT_FLUSH_CHARS = 64
+
+# Coalesce assistant text deltas: yield to Gradio at most every 50 ms or 32 new chars
+_STREAM_YIELD_INTERVAL = 0.05
+_STREAM_YIELD_CHARS = 32
+
+# How tool calls are titled in the chat
+_TOOL_TITLES = MappingProxyType({
+    "fetch_accounts": "🏢 Fetching Salesforce Accounts",
+    "fetch_contacts": "👤 Fetching Salesforce Contacts",
+    "fetch_accounts_with_contacts": "🏢 Fetching Salesforce Accounts and Contacts",
+    "bing_grounding": "🌐 Searching Web Sources"
+})
+
 
 class EventHandler(AgentEventHandler):
+    # Tools that get a summary bubble: fn_name -> (noun for the count, noun for errors).
+    # Outputs of any other tool are never decoded.
+    _TOOL_HANDLERS = MappingProxyType({
+        "fetch_accounts": ("account(s)", "accounts"),
+        "fetch_contacts": ("contact(s)", "contacts"),
+        "fetch_accounts_with_contacts": ("account(s) with contacts", "accounts with contacts"),
+    })
+
+    # Attributes touched on every streamed delta; slots keep their access cheap
+    __slots__ = (
+        "_current_message_id",
+        "_current_tools",
+        "conversation",
+        "create_tool_bubble_fn",
+        "tracer",
+        "_trace_enabled",
+        "_stdout",
+        "_pending_write",
+        "_pending_len",
+    )
+
     def __init__(self, tracer=None):
         super().__init__()
         self._current_message_id = None
-        self._accumulated_text = ""
         self._current_tools = {}
         self.conversation = None
         self.create_tool_bubble_fn = None
         self.tracer = tracer
+        self._trace_enabled = tracer is not None
+        self._stdout = sys.stdout
+        self._pending_write = []
+        self._pending_len = 0
+
+    def _flush_output(self) -> None:
+        """Write out buffered assistant text, keeping it ordered with other console output"""
+        if not self._pending_write:
+            return
+        self._stdout.write("".join(self._pending_write))
+        self._stdout.flush()
+        self._pending_write.clear()
+        self._pending_len = 0
 
     def on_message_delta(self, delta: MessageDeltaChunk) -> None:
         if delta.id != self._current_message_id:
             # Start a new message
+            self._flush_output()
             if self._current_message_id is not None:
                 print()
             self._current_message_id = delta.id
-            self._accumulated_text = ""
             print("\nassistant> ", end="")
 
         partial_text = ""
         if delta.delta.content:
-            for chunk in delta.delta.content:
-                partial_text += chunk.text.get("value", "")
-        self._accumulated_text += partial_text
-        print(partial_text, end="", flush=True)
+            partial_text = "".join(chunk.text.get("value", "") for chunk in delta.delta.content)
+
+        # Batch console writes instead of flushing stdout on every chunk
+        self._pending_write.append(partial_text)
+        self._pending_len += len(partial_text)
+        if self._pending_len >= _STDOUT_FLUSH_CHARS or "\n" in partial_text:
+            self._flush_output()
 
     def on_thread_message(self, message: ThreadMessage) -> None:
         if message.status == "completed" and message.role == "assistant":
-            if self.tracer:
-                span = trace.get_current_span()
-                span.set_attribute("message_id", message.id)
-                span.set_attribute("message_status", message.status)
-                span.set_attribute("message_role", message.role)
+            if self._trace_enabled:
+                trace.get_current_span().set_attributes({
+                    "message_id": message.id,
+                    "message_status": message.status,
+                    "message_role": message.role,
+                })
             
+            self._flush_output()
             print()
             self._current_message_id = None
-            self._accumulated_text = ""
 
     def on_thread_run(self, run: ThreadRun) -> None:
+        self._flush_output()
         print(f"thread_run status > {run.status}")
         
-        if self.tracer:
-            span = trace.get_current_span()
-            span.set_attribute("run_id", run.id)
-            span.set_attribute("run_status", run.status)
-        
         if run.status == "failed":
             print(f"error > {run.last_error}")
-            if self.tracer:
-                span.set_attribute("error", str(run.last_error))
+        
+        if self._trace_enabled:
+            attributes = {"run_id": run.id, "run_status": run.status}
+            if run.status == "failed":
+                attributes["error"] = str(run.last_error)
+            trace.get_current_span().set_attributes(attributes)
 
     def on_run_step(self, step: RunStep) -> None:
+        self._flush_output()
         print(f"step> {step.type} status={step.status}")
         
-        if self.tracer:
-            span = trace.get_current_span()
-            span.set_attribute("step_id", step.id)
-            span.set_attribute("step_type", step.type)
-            span.set_attribute("step_status", step.status)
+        if self._trace_enabled:
+            trace.get_current_span().set_attributes({
+                "step_id": step.id,
+                "step_type": step.type,
+                "step_status": step.status,
+            })
         
         # If we got a successful completion from a tool, we can do custom logging or UI updates here
         if step.status == "completed" and step.step_details and step.step_details.tool_calls:
             for tcall in step.step_details.tool_calls:
                 if getattr(tcall, "function", None):
                     fn_name = tcall.function.name
+                    handler = self._TOOL_HANDLERS.get(fn_name)
+                    if not handler or not self.create_tool_bubble_fn:
+                        continue
                     try:
-                        output = json.loads(tcall.function.output)
+                        output = _loads(tcall.function.output)
                         
                         # For Salesforce functions
-                        if fn_name == "fetch_accounts":
-                            if "error" in output:
-                                message = f"Error fetching accounts: {output['error']}"
-                            else:
-                                account_count = output.get("totalSize", 0)
-                                message = f"Found {account_count} account(s)."
-                            
-                            if self.create_tool_bubble_fn:
-                                self.create_tool_bubble_fn(fn_name, message, tcall.id)
+                        noun, kind = handler
+                        if "error" in output:
+                            message = f"Error fetching {kind}: {output['error']}"
+                        else:
+                            message = f"Found {output.get('totalSize', 0)} {noun}."
                         
-                        elif fn_name == "fetch_contacts":
-                            if "error" in output:
-                                message = f"Error fetching contacts: {output['error']}"
-                            else:
-                                contact_count = output.get("totalSize", 0)
-                                message = f"Found {contact_count} contact(s)."
-                            
-                            if self.create_tool_bubble_fn:
-                                self.create_tool_bubble_fn(fn_name, message, tcall.id)
-
-                    except json.JSONDecodeError:
+                        self.create_tool_bubble_fn(fn_name, message, tcall.id)
+
+                    except orjson.JSONDecodeError:
                         print(f"Error parsing tool output: {tcall.function.output}")
 
     def on_run_step_delta(self, delta: RunStepDeltaChunk) -> None:
+        self._flush_output()
         if delta.delta.step_details and delta.delta.step_details.tool_calls:
             for tcall in delta.delta.step_details.tool_calls:
                 if getattr(tcall, "function", None):
@@ -119,11 +170,11 @@ def convert_dict_to_chatmessage(msg: dict) -> ChatMessage:
 
 
 def create_chat_interface(project_client, agent, thread, tracer=None):
-    last_message = None
-    last_message_timestamp = 0
+    # (hash of the last message, monotonic time it was sent)
+    last_key = (0, 0.0)
     
     def azure_sf_chat(user_message: str, history: List[dict]):
-        nonlocal last_message, last_message_timestamp
+        nonlocal last_key
         
         # Start a span for the entire chat interaction
         chat_span = None
@@ -134,14 +185,16 @@ def create_chat_interface(project_client, agent, thread, tracer=None):
             chat_span.set_attribute("agent_id", agent.id)
         
         try:
-            if last_message == user_message and time.time() - last_message_timestamp < 5:
+            message_hash = hash(user_message)
+            now = time.monotonic()
+            if last_key[0] == message_hash and now - last_key[1] < 5:
                 # To prevent double sending if user quickly hits Enter
                 if chat_span:
                     chat_span.set_attribute("duplicate_message", True)
                     chat_span.end()
                 return history, ""
                 
-            last_message_timestamp = time.time()
+            last_key = (message_hash, now)
 
             conversation = [convert_dict_to_chatmessage(m) for m in history]
             conversation.append(ChatMessage(role="user", content=user_message))
@@ -155,28 +208,35 @@ def create_chat_interface(project_client, agent, thread, tracer=None):
                 
                 project_client.agents.create_message(thread_id=thread.id, role="user", content=user_message)
 
-            # Define how to display tool calls
-            tool_titles = {
-                "fetch_accounts": "🏢 Fetching Salesforce Accounts",
-                "fetch_contacts": "👤 Fetching Salesforce Contacts",
-                "bing_grounding": "🌐 Searching Web Sources"
-            }
+            # Bubbles already shown this turn, keyed by tool call id
+            tool_bubbles = {}
+            # Bubbles still waiting for their tool step to complete
+            pending_tool_bubbles = []
 
-            def create_tool_bubble(tool_name: str, content: str = "", call_id: str = None):
+            def create_tool_bubble(tool_name: str, content: str = "", call_id: str = None, pending: bool = False):
                 if tool_name is None:
                     return
+
+                # Repeated events for the same call update the existing bubble
+                if call_id and call_id in tool_bubbles:
+                    msg = tool_bubbles[call_id]
+                    msg.content = content
+                    return msg
                 
-                title = tool_titles.get(tool_name, f"🛠️ {tool_name}")
+                title = _TOOL_TITLES.get(tool_name, f"🛠️ {tool_name}")
                 
-                msg = ChatMessage(
-                    role="assistant",
-                    content=content,
-                    metadata={
-                        "title": title,
-                        "id": f"tool-{call_id}" if call_id else "tool-noid"
-                    }
-                )
+                metadata = {
+                    "title": title,
+                    "id": f"tool-{call_id}" if call_id else "tool-noid"
+                }
+                msg = ChatMessage(role="assistant", content=content, metadata=metadata)
                 conversation.append(msg)
+                # Only bubbles for tools still running are shown as pending
+                if pending:
+                    metadata["status"] = "pending"
+                    pending_tool_bubbles.append(msg)
+                if call_id:
+                    tool_bubbles[call_id] = msg
                 return msg
 
             # Prepare event handler
@@ -184,6 +244,10 @@ def create_chat_interface(project_client, agent, thread, tracer=None):
             event_handler.conversation = conversation
             event_handler.create_tool_bubble_fn = create_tool_bubble
 
+            # Text received since the last yield, and when that yield happened
+            pending_chars = 0
+            last_yield = time.monotonic()
+
             # Create streaming session for the agent's response
             with project_client.agents.create_stream(
                 thread_id=thread.id,
@@ -199,27 +263,30 @@ def create_chat_interface(project_client, agent, thread, tracer=None):
                         if step_delta.get("type") == "tool_calls":
                             for tcall in step_delta.get("tool_calls", []):
                                 call_id = tcall.get("id")
-                                if tcall.get("type") == "bing_grounding":
-                                    search_query = tcall.get("bing_grounding", {}).get("requesturl", "").split("?q=")[-1]
+                                # Calls that already have a bubble don't need their URL parsed again;
+                                # id-less calls are never in tool_bubbles, so each still gets one
+                                if tcall.get("type") == "bing_grounding" and call_id not in tool_bubbles:
+                                    request_url = tcall.get("bing_grounding", {}).get("requesturl", "")
+                                    i = request_url.rfind("?q=")
+                                    search_query = request_url[i + 3:] if i >= 0 else request_url
                                     if search_query:
-                                        create_tool_bubble("bing_grounding", f"Searching for '{search_query}'...", call_id)
+                                        create_tool_bubble("bing_grounding", f"Searching for '{search_query}'...", call_id, pending=True)
                             yield conversation, ""
 
-                    elif event_type == "run_step":
+                    elif event_type == "thread.run.step.completed":
                         # Completed tool usage
                         if event_data["type"] == "tool_calls" and event_data["status"] == "completed":
-                            for msg in conversation:
-                                if msg.metadata and msg.metadata.get("status") == "pending":
-                                    msg.metadata["status"] = "done"
+                            for msg in pending_tool_bubbles:
+                                msg.metadata["status"] = "done"
+                            pending_tool_bubbles.clear()
                             yield conversation, ""
 
                     elif event_type == "thread.message.delta":
                         # This is partial text from the assistant
-                        content = ""
+                        content_parts = []
                         citations = []
                         for chunk in event_data["delta"]["content"]:
-                            chunk_value = chunk["text"].get("value", "")
-                            content += chunk_value
+                            content_parts.append(chunk["text"].get("value", ""))
                             # If the chunk includes citations
                             if "annotations" in chunk["text"]:
                                 for annotation in chunk["text"]["annotations"]:
@@ -227,6 +294,7 @@ def create_chat_interface(project_client, agent, thread, tracer=None):
                                         url_citation = annotation.get("url_citation", {})
                                         citation_text = f"{annotation.get('text', '')} [{url_citation.get('title', '')}]({url_citation.get('url', '')})"
                                         citations.append(citation_text)
+                        content = "".join(content_parts)
                         citations_str = "\n" + "\n".join(citations) if citations else ""
                         
                         # If we don't have an "assistant" message or last message has metadata, create a new one
@@ -235,7 +303,18 @@ def create_chat_interface(project_client, agent, thread, tracer=None):
                         else:
                             # Append to the existing last assistant message
                             conversation[-1].content += content + citations_str
-                        yield conversation, ""
+
+                        # Only re-send the transcript once enough text has piled up
+                        pending_chars += len(content) + len(citations_str)
+                        now = time.monotonic()
+                        if pending_chars >= _STREAM_YIELD_CHARS or now - last_yield >= _STREAM_YIELD_INTERVAL:
+                            pending_chars = 0
+                            last_yield = now
+                            yield conversation, ""
+
+            # Flush whatever text arrived after the last coalesced yield
+            if pending_chars:
+                yield conversation, ""
 
             if chat_span:
                 chat_span.set_attribute("conversation_length", len(conversation))
@@ -251,15 +330,3 @@ def create_chat_interface(project_client, agent, thread, tracer=None):
             raise
 
     return azure_sf_chat
-
-
-# Helper context manager for when no tracer is provided
-class nullcontext:
-    def __init__(self, enter_result=None):
-        self.enter_result = enter_result
-
-    def __enter__(self):
-        return self.enter_result
-
-    def __exit__(self, *excinfo):
-        pass
\ No newline at end of file
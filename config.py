@@ -0,0 +1,27 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Settings read once from the environment (call load_dotenv first)"""
+    conn_str: str
+    model: str = "gpt-4"
+    bing_conn: Optional[str] = None
+    test_concurrency: int = 4
+    test_min_interval: float = 1.0
+    trace_content: bool = False
+    trace_sampling_ratio: float = 1.0
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        """Snapshot the current environment into a Config"""
+        return cls(
+            conn_str=os.environ["PROJECT_CONNECTION_STRING"],
+            model=os.environ.get("MODEL_DEPLOYMENT_NAME", "gpt-4"),
+            bing_conn=os.environ.get("BING_CONNECTION_NAME"),
+            test_concurrency=int(os.environ.get("SF_TEST_CONCURRENCY", "4")),
+            test_min_interval=float(os.environ.get("SF_TEST_MIN_INTERVAL", "1")),
+            trace_content=os.environ.get("SF_TRACE_CONTENT", "0") == "1",
+            trace_sampling_ratio=float(os.environ.get("OTEL_TRACES_SAMPLER_ARG", "1.0")),
+        )
@@ -1,24 +1,39 @@
 import os
-import json
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from datetime import datetime
 from typing import Dict, List
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from azure.core.pipeline.transport import RequestsTransport
 from azure.identity import DefaultAzureCredential
 from azure.ai.projects import AIProjectClient
-from azure.ai.projects.models import FunctionTool, ToolSet
+from azure.ai.projects.models import (
+    AgentEventHandler,
+    FunctionTool,
+    MessageDeltaChunk,
+    RunStep,
+    ThreadRun,
+    ToolSet
+)
+
+# Load .env before importing modules that read settings at import time
+load_dotenv(override=True)
+
+from config import Config
 
 # Import our Salesforce functions
-from sf_functions import fetch_accounts, fetch_contacts
+from sf_functions import fetch_accounts, fetch_contacts, fetch_accounts_with_contacts
 
 def load_test_queries() -> List[Dict]:
     """Load test queries from JSONL file"""
-    queries = []
-    with open('test_queries.jsonl', 'r') as f:
-        for line in f:
-            if line.strip():  # Skip empty lines
-                queries.append(json.loads(line))
-    return queries
+    # Read raw bytes so orjson can parse each line without a text decode step
+    with open('test_queries.jsonl', 'rb') as f:
+        return [orjson.loads(line) for line in f if not line.isspace()]  # Skip empty lines
 
 def save_test_results(results: List[Dict]):
     """Save test results to a timestamped JSONL file"""
@@ -29,14 +44,14 @@ def save_test_results(results: List[Dict]):
     output_file = os.path.join(output_dir, f'test_results_{timestamp}.jsonl')
     
     # Write each result as a separate JSON line
-    with open(output_file, 'w') as f:
-        f.write(json.dumps({"timestamp": datetime.now().isoformat()}) + '\n')
+    with open(output_file, 'wb', buffering=1 << 20) as f:
+        f.write(orjson.dumps({"timestamp": datetime.now().isoformat()}, option=orjson.OPT_APPEND_NEWLINE))
         for result in results:
-            f.write(json.dumps(result) + '\n')
+            f.write(orjson.dumps(result, option=orjson.OPT_APPEND_NEWLINE))
     
     print(f"Results saved to {output_file}")
 
-def get_or_create_agent(project_client: AIProjectClient) -> str:
+def get_or_create_agent(project_client: AIProjectClient, model: str) -> str:
     """Gets existing agent or creates a new one"""
     AGENT_NAME = "salesforce-assistant"
     
@@ -48,15 +63,16 @@ def get_or_create_agent(project_client: AIProjectClient) -> str:
 
     # Build toolset - this is critical to prevent "Toolset is not available" error
     toolset = ToolSet()
-    toolset.add(FunctionTool({fetch_accounts, fetch_contacts}))
+    toolset.add(FunctionTool({fetch_accounts, fetch_contacts, fetch_accounts_with_contacts}))
 
     # Define the agent instructions
     instructions = """
     You are a helpful Salesforce assistant that can retrieve information from a Salesforce instance. Follow these rules:
     1. If the user wants to look up Salesforce accounts, call the `fetch_accounts` function.
     2. If the user wants to look up Salesforce contacts, call the `fetch_contacts` function.
-    3. Provide relevant answers to the user in a concise yet complete manner.
-    4. Format the results in a readable way when displaying account or contact information.
+    3. If the user wants accounts together with their contacts, call the `fetch_accounts_with_contacts` function.
+    4. Provide relevant answers to the user in a concise yet complete manner.
+    5. Format the results in a readable way when displaying account or contact information.
     """
 
     if found_agent:
@@ -71,7 +87,7 @@ def get_or_create_agent(project_client: AIProjectClient) -> str:
     else:
         # Create new agent with toolset
         agent = project_client.agents.create_agent(
-            model=os.environ.get("MODEL_DEPLOYMENT_NAME", "gpt-4"),
+            model=model,
             name=AGENT_NAME,
             instructions=instructions,
             toolset=toolset
@@ -80,118 +96,174 @@ def get_or_create_agent(project_client: AIProjectClient) -> str:
     
     return agent.id
 
-def run_automated_tests(project_client: AIProjectClient):
-    """Execute automated tests using the Salesforce agent"""
-    results = []
-    queries = load_test_queries()
+class TestCaptureHandler(AgentEventHandler):
+    """
+    Quietly collects tool outputs and the assistant reply from a streamed test run.
+    Nothing is printed, so concurrent test workers don't interleave console output.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.context_entries: List[Dict] = []
+        self.final_text: List[str] = []
+        self.run = None
+        self.error = None
+        self._message_id = None
+
+    def on_message_delta(self, delta: MessageDeltaChunk) -> None:
+        # Keep only the latest assistant message, as the response
+        if delta.id != self._message_id:
+            self._message_id = delta.id
+            self.final_text = []
+        if delta.delta.content:
+            self.final_text.extend(chunk.text.get("value", "") for chunk in delta.delta.content)
+
+    def on_thread_run(self, run: ThreadRun) -> None:
+        self.run = run
+
+    def on_error(self, data: str) -> None:
+        self.error = data
+
+    def on_run_step(self, step: RunStep) -> None:
+        # Collect tool outputs (Salesforce context) - store as plain strings
+        if step.status != "completed" or step.type != "tool_calls":
+            return
+        if not (step.step_details and step.step_details.tool_calls):
+            return
+        for tool_call in step.step_details.tool_calls:
+            if getattr(tool_call, "function", None):
+                raw_output = tool_call.function.output
+                
+                # Some outputs arrive as a JSON-encoded string; decode it so every
+                # escape sequence is handled. Anything else is stored as is.
+                if raw_output and raw_output.startswith('"'):
+                    try:
+                        raw_output = orjson.loads(raw_output)
+                    except orjson.JSONDecodeError:
+                        pass
+                
+                self.context_entries.append({
+                    "function": tool_call.function.name,
+                    "context": raw_output
+                })
+
+def create_transport(workers: int) -> RequestsTransport:
+    """HTTP transport with a keep-alive pool big enough for every worker thread"""
+    session = requests.Session()
+    # Each worker can hold two connections at once (the run stream plus the nested
+    # tool-output stream); never go below requests' default of 10
+    adapter = HTTPAdapter(pool_maxsize=max(10, 2 * workers))
+    session.mount("https://", adapter)
+    return RequestsTransport(session=session)
+
+class RateLimiter:
+    """Spaces out calls from any number of worker threads by at least min_interval seconds"""
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        # Reserve the next slot under the lock, then sleep outside it
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        time.sleep(max(0.0, slot - now))
+
+def run_single_test(project_client: AIProjectClient, query: Dict, agent_id: str,
+                    rate_limiter: RateLimiter) -> Dict:
+    """Run one test query on its own thread and return the result record"""
+    rate_limiter.wait()
+    print(f"\nProcessing Query {query['id']}: {query['question']}")
+    result = {
+        "query_id": query["id"],
+        "question": query["question"],
+        "ground_truth": query["ground_truth"],
+        "timestamp": datetime.now().isoformat()
+    }
     
-    # Get or create agent
-    agent_id = get_or_create_agent(project_client)
+    # Create a new thread for each query to avoid contention
+    thread = project_client.agents.create_thread()
+    print(f"Created thread for query {query['id']}: {thread.id}")
     
-    for query in queries:
-        time.sleep(10)
-        print(f"\nProcessing Query {query['id']}: {query['question']}")
-        result = {
-            "query_id": query["id"],
-            "question": query["question"],
-            "ground_truth": query["ground_truth"],
-            "timestamp": datetime.now().isoformat()
-        }
+    try:
+        # Send the question
+        project_client.agents.create_message(
+            thread_id=thread.id,
+            role="user",
+            content=query["question"]
+        )
         
-        # Create a new thread for each query to avoid contention
-        thread = project_client.agents.create_thread()
-        print(f"Created thread for query {query['id']}: {thread.id}")
+        # Stream the run; the handler captures tool outputs and the reply as they arrive
+        handler = TestCaptureHandler()
+        with project_client.agents.create_stream(
+            thread_id=thread.id,
+            assistant_id=agent_id,
+            event_handler=handler
+        ) as stream:
+            for _ in stream:
+                pass
         
-        try:
-            # Send the question
-            project_client.agents.create_message(
-                thread_id=thread.id,
-                role="user",
-                content=query["question"]
-            )
-            
-            # Process the run
-            run = project_client.agents.create_and_process_run(
-                thread_id=thread.id,
-                assistant_id=agent_id
-            )
-            
-            # Check for failure
-            if run.status == "failed":
-                result["status"] = "failed"
-                result["error"] = str(run.last_error)
-                print(f"Run failed: {run.last_error}")
-                results.append(result)
-                continue
-            
-            # Add a slight delay to ensure run completion
-            time.sleep(1)
-            
-            # Get run steps to find tool outputs
-            run_steps = project_client.agents.list_run_steps(
-                run_id=run.id,
-                thread_id=thread.id
-            )
-            
-            # Collect tool outputs (Salesforce context) - store as plain strings
-            context_entries = []
-            for step in run_steps.data:
-                if step.type == "tool_calls" and step.step_details and step.step_details.tool_calls:
-                    for tool_call in step.step_details.tool_calls:
-                        if getattr(tool_call, "function", None):
-                            try:
-                                # Store raw output as is - no processing or JSON parsing
-                                raw_output = tool_call.function.output
-                                
-                                # Remove any surrounding quotes if present
-                                if raw_output and raw_output.startswith('"') and raw_output.endswith('"'):
-                                    raw_output = raw_output[1:-1]
-                                    # Unescape interior quotes if needed
-                                    raw_output = raw_output.replace('\\"', '"')
-                                
-                                context_entries.append({
-                                    "function": tool_call.function.name,
-                                    "context": raw_output
-                                })
-                            except Exception as e:
-                                print(f"Warning: Error processing tool output: {str(e)}")
-            
-            # Get the assistant's response
-            messages = project_client.agents.list_messages(thread_id=thread.id)
-            latest_message = next((msg for msg in messages.data if msg.role == "assistant"), None)
-            
-            result.update({
-                "status": "completed",
-                "context": context_entries,
-                "response": latest_message.content[0].text.value if latest_message else None
-            })
-            
-            print("Query completed successfully")
-            
-        except Exception as e:
-            result.update({
-                "status": "error",
-                "error": str(e)
-            })
-            print(f"Error processing query: {str(e)}")
+        # Anything short of a completed run is a failure; a stream can end early
+        # (e.g. on a server error event) with no run or a non-final one
+        run = handler.run
+        if run is None or run.status != "completed":
+            result["status"] = run.status if run else "no_run"
+            result["error"] = str(run.last_error) if run and run.last_error else handler.error
+            print(f"Run did not complete ({result['status']}): {result['error']}")
+            return result
         
-        results.append(result)
+        result.update({
+            "status": "completed",
+            "context": handler.context_entries,
+            "response": "".join(handler.final_text) if handler.final_text else None
+        })
+        
+        print(f"Query {query['id']} completed successfully")
+        
+    except Exception as e:
+        result.update({
+            "status": "error",
+            "error": str(e)
+        })
+        print(f"Error processing query {query['id']}: {str(e)}")
+    
+    return result
+
+def run_automated_tests(project_client: AIProjectClient, config: Config):
+    """Execute automated tests using the Salesforce agent"""
+    queries = load_test_queries()
+    
+    # Get or create agent
+    agent_id = get_or_create_agent(project_client, config.model)
+
+    # Minimum spacing between query starts, to stay within the service rate limits
+    rate_limiter = RateLimiter(config.test_min_interval)
+
+    # Queries are independent, so fan them out; map() keeps results in query order
+    run_one = partial(run_single_test, project_client, agent_id=agent_id, rate_limiter=rate_limiter)
+    with ThreadPoolExecutor(max_workers=config.test_concurrency) as executor:
+        results = list(executor.map(run_one, queries))
     
     return results
 
 def main():
-    load_dotenv(override=True)
+    config = Config.from_env()
     
     # Initialize Azure AI client
     credential = DefaultAzureCredential()
     project_client = AIProjectClient.from_connection_string(
         credential=credential,
-        conn_str=os.environ["PROJECT_CONNECTION_STRING"]
+        conn_str=config.conn_str,
+        # Share one connection pool across all test queries and workers
+        transport=create_transport(config.test_concurrency)
     )
     
     # Run tests
     print("Starting automated tests...")
-    results = run_automated_tests(project_client)
+    results = run_automated_tests(project_client, config)
     
     # Save results
     save_test_results(results)
@@ -1,10 +1,13 @@
 # main.py
 
-import os
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
 
+from config import Config
+
+CFG = Config.from_env()
+
 # Azure identity and AI Project
 from azure.identity import DefaultAzureCredential
 from azure.ai.projects import AIProjectClient
@@ -15,7 +18,7 @@ from azure.ai.projects.models import (
 )
 
 # Our custom Salesforce functions
-from sf_functions import fetch_accounts, fetch_contacts
+from sf_functions import fetch_accounts, fetch_contacts, fetch_accounts_with_contacts
 
 # Import the Gradio chat interface creator
 import gradio as gr
@@ -30,19 +33,19 @@ from tracing import setup_tracing
 credential = DefaultAzureCredential()
 project_client = AIProjectClient.from_connection_string(
     credential=credential,
-    conn_str=os.environ["PROJECT_CONNECTION_STRING"]  # Set in your .env
+    conn_str=CFG.conn_str  # Set in your .env
 )
 
 # --------------------------------------------------
 # 1.1) Setup OpenTelemetry Tracing
 # --------------------------------------------------
-tracer = setup_tracing(project_client)
+tracer = setup_tracing(project_client, CFG.trace_content, CFG.trace_sampling_ratio)
 
 # --------------------------------------------------
 # 2) Setup the Bing Grounding Tool if desired
 # --------------------------------------------------
 bing_tool = None
-bing_connection_name = os.environ.get("BING_CONNECTION_NAME")
+bing_connection_name = CFG.bing_conn
 if bing_connection_name:
     try:
         with tracer.start_as_current_span("setup_bing_tool") as span:
@@ -59,9 +62,16 @@ if bing_connection_name:
 # --------------------------------------------------
 AGENT_NAME = "salesforce-assistant"
 
+# Questions offered as one-click examples in the UI
+EXAMPLE_QUESTIONS = (
+    "What is the address of Microsoft, as per salesforce?",
+    "Find contacts with 'Furter' in their name (in salesforce)",
+    "What are some recent news about Azure AI Agent Service?",
+)
+
 with tracer.start_as_current_span("setup_agent") as span:
     span.set_attribute("agent_name", AGENT_NAME)
-    span.set_attribute("model", os.environ.get("MODEL_DEPLOYMENT_NAME", "gpt-4"))
+    span.set_attribute("model", CFG.model)
     
     # Find existing agent
     found_agent = next(
@@ -77,7 +87,7 @@ with tracer.start_as_current_span("setup_agent") as span:
         toolset.add(bing_tool)
 
     # Add our Salesforce functions
-    toolset.add(FunctionTool({fetch_accounts, fetch_contacts}))
+    toolset.add(FunctionTool({fetch_accounts, fetch_contacts, fetch_accounts_with_contacts}))
 
     # Define the new instructions for the agent
     instructions = """
@@ -90,10 +100,13 @@ with tracer.start_as_current_span("setup_agent") as span:
     3. If the user wants to look up Salesforce contacts, call the `fetch_contacts` function.
        - They might specify an account ID, name filter, or limit.
        - For example: "Show me contacts for account 001xxxxxxxxxxx" or "Find contacts with 'Smith' in their name"
-    4. Provide relevant answers to the user in a concise yet complete manner.
-    5. Always ensure the user's request is properly addressed.
-    6. Format the results in a readable way when displaying account or contact information.
-    7. Never share Salesforce credentials or sensitive information.
+    4. If the user wants accounts together with their contacts, call the `fetch_accounts_with_contacts` function
+       once instead of calling `fetch_contacts` for each account.
+       - For example: "Show me the 'Tech' accounts and their contacts"
+    5. Provide relevant answers to the user in a concise yet complete manner.
+    6. Always ensure the user's request is properly addressed.
+    7. Format the results in a readable way when displaying account or contact information.
+    8. Never share Salesforce credentials or sensitive information.
     """
 
     if found_agent:
@@ -109,7 +122,7 @@ with tracer.start_as_current_span("setup_agent") as span:
         # Create new
         span.set_attribute("agent_action", "create")
         agent = project_client.agents.create_agent(
-            model=os.environ.get("MODEL_DEPLOYMENT_NAME", "gpt-4"),
+            model=CFG.model,
             name=AGENT_NAME,
             instructions=instructions,
             toolset=toolset
@@ -147,9 +160,7 @@ with gr.Blocks(title="Azure AI - Salesforce Assistant") as demo:
     # Example questions
     gr.Markdown("### Example Questions")
     with gr.Row():
-        q1 = gr.Button("What is the address of Microsoft, as per salesforce?")
-        q2 = gr.Button("Find contacts with 'Furter' in their name (in salesforce)")
-        q3 = gr.Button("What are some recent news about Azure AI Agent Service?")
+        example_buttons = [gr.Button(question) for question in EXAMPLE_QUESTIONS]
 
     # Handle clearing chat
     clear_button.click(fn=clear_history, outputs=chatbot)
@@ -161,7 +172,7 @@ with gr.Blocks(title="Azure AI - Salesforce Assistant") as demo:
             return question
 
     # Wire example question buttons
-    for btn in [q1, q2, q3]:
+    for btn in example_buttons:
         btn.click(fn=set_example_question, inputs=btn, outputs=input_box) \
            .then(salesforce_chat, inputs=[input_box, chatbot], outputs=[chatbot, input_box]) \
            .then(lambda: "", outputs=input_box)
@@ -1,26 +1,226 @@
 import os
-import json
-from typing import Any, Dict, Optional, List
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, List, Tuple
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from opentelemetry import trace
+from cachetools import TTLCache
 from simple_salesforce import Salesforce
+from simple_salesforce.exceptions import SalesforceExpiredSession
 
-# Get the tracer
-tracer = trace.get_tracer(__name__)
+# Tracer resolved on first use, after setup_tracing has installed the provider,
+# so spans don't go through the proxy tracer on every call
+_TRACER = None
 
-def connect_to_salesforce():
+def _tracer():
+    global _TRACER
+    _TRACER = _TRACER or trace.get_tracer(__name__)
+    return _TRACER
+
+# Static SELECT prefixes for the fetch queries
+_ACCOUNT_SELECT = "SELECT Id, Name, Industry, Type, BillingCity, BillingState, BillingCountry, Phone, Website FROM Account"
+_CONTACT_SELECT = "SELECT Id, FirstName, LastName, Email, Phone, Title, AccountId, Account.Name FROM Contact"
+
+# Accounts with their most recent contacts in one parent-child query; {} is the per-account contact limit
+_ACCOUNT_WITH_CONTACTS_SELECT = (
+    "SELECT Id, Name, Industry, Type, BillingCity, BillingState, BillingCountry, Phone, Website, "
+    "(SELECT Id, FirstName, LastName, Email, Phone, Title FROM Contacts ORDER BY CreatedDate DESC LIMIT {}) "
+    "FROM Account"
+)
+
+# Above this many rows, records are streamed and encoded one at a time to bound peak memory
+_STREAM_THRESHOLD = 500
+
+# Escape tables for quoted SOQL values; LIKE patterns also escape the % and _ wildcards
+_SOQL_ESCAPE = str.maketrans({"'": "\\'", "\\": "\\\\"})
+_SOQL_LIKE_ESCAPE = str.maketrans({"'": "\\'", "\\": "\\\\", "%": "\\%", "_": "\\_"})
+
+def _soql_escape(value: str) -> str:
+    """Escape a value for use inside a quoted SOQL string literal"""
+    return value.translate(_SOQL_ESCAPE)
+
+def _soql_like(value: str) -> str:
+    """Escape a value for use inside a quoted SOQL LIKE pattern"""
+    return value.translate(_SOQL_LIKE_ESCAPE)
+
+# Recent tool responses keyed by the assembled SOQL query, so repeated agent calls skip Salesforce
+_RESULT_CACHE = TTLCache(maxsize=128, ttl=60)
+_CACHE_LOCK = threading.RLock()
+
+def _cache_get(query: str) -> Optional[str]:
+    with _CACHE_LOCK:
+        return _RESULT_CACHE.get(query)
+
+def _cache_put(query: str, response: str):
+    with _CACHE_LOCK:
+        _RESULT_CACHE[query] = response
+
+def invalidate_all():
     """
-    Creates a connection to Salesforce using environment variables
+    Clears all cached query results. Call this after any tool that writes to Salesforce.
+    """
+    with _CACHE_LOCK:
+        _RESULT_CACHE.clear()
+
+# Pieces of the {"<key>": [...], "totalSize": n} response envelope; only the records and count vary
+_ACCOUNTS_PREFIX = b'{"accounts":'
+_CONTACTS_PREFIX = b'{"contacts":'
+_TOTAL_SIZE_PREFIX = b',"totalSize":'
+_ENVELOPE_SUFFIX = b"}"
+
+def _envelope(prefix: bytes, records_json: bytes, total: int) -> str:
+    """Splice encoded records and their count into the response envelope"""
+    return (prefix + records_json + _TOTAL_SIZE_PREFIX + str(total).encode() + _ENVELOPE_SUFFIX).decode("utf-8")
+
+def _dumps(obj: Any) -> str:
+    """Serialize a tool response with orjson; the agent runtime expects str, not bytes"""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+def _strip_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop attributes and null values from a record in place; the record is ours after parsing"""
+    record.pop("attributes", None)
+    for key in [k for k, v in record.items() if v is None]:
+        del record[key]
+    return record
+
+def _clean_account(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop attributes and null values from an account record"""
+    return _strip_record(record)
+
+def _clean_contact(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Lift Account.Name to AccountName, and drop attributes, the Account subobject and null values"""
+    account = record.pop("Account", None)
+    _strip_record(record)
+    if account and account.get("Name") is not None:
+        record["AccountName"] = account["Name"]
+    return record
+
+def _clean_account_with_contacts(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Clean an account record and flatten its Contacts subquery into a list of cleaned contacts"""
+    contacts = record.pop("Contacts", None) or {}
+    _clean_account(record)
+    record["Contacts"] = [_clean_contact(contact) for contact in contacts.get("records", ())]
+    return record
+
+def _encode_records(records, prefix: bytes,
+                    clean: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Tuple[str, int]:
+    """
+    Encodes the response envelope one cleaned record at a time, so the raw,
+    cleaned and serialized copies of a large result never exist all at once
+    """
+    buf = bytearray(b"[")
+    count = 0
+    for record in records:
+        if count:
+            buf += b","
+        buf += orjson.dumps(clean(record), option=orjson.OPT_NON_STR_KEYS)
+        count += 1
+    buf += b"]"
+    return _envelope(prefix, buf, count), count
+
+# Salesforce credentials don't change at runtime, so read them once at import
+_SF_USERNAME = os.environ.get("SF_USERNAME")
+_SF_PASSWORD = os.environ.get("SF_PASSWORD")
+_SF_TOKEN = os.environ.get("SF_SECURITY_TOKEN")
+_SF_DOMAIN = os.environ.get("SF_DOMAIN", "login")
+
+# Shared Salesforce connection, created on first use so each tool call skips the login round-trip
+_SF_CLIENT: Optional[Salesforce] = None
+_SF_LOCK = threading.Lock()
+
+def _create_session() -> requests.Session:
+    """
+    HTTP session for Salesforce with a keep-alive pool shared by concurrent tool calls,
+    retrying transient gateway errors instead of forcing a new login
+    """
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.1, status_forcelist=(502, 503, 504))
+    session.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=retries))
+    return session
+
+def _get_sf_client() -> Salesforce:
+    """
+    Returns the shared Salesforce connection, logging in with the environment credentials on first use.
+    Login errors propagate to the caller.
+    """
+    global _SF_CLIENT
+    if _SF_CLIENT is None:
+        with _SF_LOCK:
+            if _SF_CLIENT is None:
+                _SF_CLIENT = Salesforce(
+                    username=_SF_USERNAME,
+                    password=_SF_PASSWORD,
+                    security_token=_SF_TOKEN,
+                    domain=_SF_DOMAIN,
+                    session=_create_session(),
+                    # Plain dicts instead of OrderedDict for every parsed record
+                    object_pairs_hook=dict
+                )
+    return _SF_CLIENT
+
+def _discard_connection(sf: Salesforce):
+    """
+    Drops the shared connection if it is still the given one, so the next call logs in again
+    """
+    global _SF_CLIENT
+    with _SF_LOCK:
+        if _SF_CLIENT is sf:
+            _SF_CLIENT = None
+
+def _query(sf: Salesforce, query: str) -> Dict[str, Any]:
+    """
+    Runs a SOQL query, logging in again once if the shared session has expired
     """
     try:
-        return Salesforce(
-            username=os.environ.get("SF_USERNAME"),
-            password=os.environ.get("SF_PASSWORD"),
-            security_token=os.environ.get("SF_SECURITY_TOKEN"),
-            domain=os.environ.get("SF_DOMAIN", "login")
-        )
-    except Exception as e:
-        print(f"Error connecting to Salesforce: {str(e)}")
-        return None
+        return sf.query(query, include_deleted=False)
+    except SalesforceExpiredSession:
+        _discard_connection(sf)
+        return _get_sf_client().query(query, include_deleted=False)
+
+def _stream_query(sf: Salesforce, query: str, prefix: bytes,
+                  clean: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Tuple[str, int]:
+    """
+    Runs a large SOQL query with query_all_iter and encodes the records as they arrive,
+    logging in again once if the shared session has expired
+    """
+    try:
+        return _encode_records(sf.query_all_iter(query, include_deleted=False), prefix, clean)
+    except SalesforceExpiredSession:
+        _discard_connection(sf)
+        return _encode_records(_get_sf_client().query_all_iter(query, include_deleted=False), prefix, clean)
+
+def _run_fetch(span, query: str, limit: int, prefix: bytes,
+               clean: Callable[[Dict[str, Any]], Dict[str, Any]]) -> str:
+    """
+    Returns the JSON response for a fetch query, serving repeats from the short-lived result cache.
+    Large limits are streamed; connection and query errors propagate to the caller's span.
+    """
+    cached = _cache_get(query)
+    span.set_attribute("cache", "hit" if cached is not None else "miss")
+    if cached is not None:
+        return cached
+    
+    start_ns = time.perf_counter_ns()
+    if limit > _STREAM_THRESHOLD:
+        response, record_count = _stream_query(_get_sf_client(), query, prefix, clean)
+    else:
+        result = _query(_get_sf_client(), query)
+        record_count = len(result["records"])
+        records = [clean(record) for record in result["records"]]
+        response = _envelope(prefix, orjson.dumps(records, option=orjson.OPT_NON_STR_KEYS), result["totalSize"])
+    
+    if span.is_recording():
+        span.set_attributes({
+            "soql_query": query,
+            "sf.query_ms": (time.perf_counter_ns() - start_ns) / 1e6,
+            "record_count": record_count,
+        })
+    
+    _cache_put(query, response)
+    return response
 
 def fetch_accounts(limit: int = 10, name_filter: Optional[str] = None) -> str:
     """
@@ -33,47 +233,27 @@ def fetch_accounts(limit: int = 10, name_filter: Optional[str] = None) -> str:
     Returns:
         JSON string with account records
     """
-    with tracer.start_as_current_span("fetch_accounts") as span:
-        span.set_attribute("limit", limit)
-        if name_filter:
-            span.set_attribute("name_filter", name_filter)
-        
+    attributes = {"limit": limit}
+    if name_filter:
+        attributes["name_filter"] = name_filter
+    
+    with _tracer().start_as_current_span("fetch_accounts", attributes=attributes) as span:
         try:
-            sf = connect_to_salesforce()
-            if not sf:
-                error_msg = "Failed to connect to Salesforce"
-                span.set_attribute("error", error_msg)
-                return json.dumps({"error": error_msg})
+            limit = int(limit)
             
             # Construct the query
-            query = f"SELECT Id, Name, Industry, Type, BillingCity, BillingState, BillingCountry, Phone, Website FROM Account"
+            parts = [_ACCOUNT_SELECT]
             if name_filter:
-                query += f" WHERE Name LIKE '%{name_filter}%'"
-            query += f" ORDER BY CreatedDate DESC LIMIT {limit}"
+                parts.append(" WHERE Name LIKE '%" + _soql_like(name_filter) + "%'")
+            parts.append(" ORDER BY CreatedDate DESC LIMIT {}".format(limit))
+            query = "".join(parts)
             
-            span.set_attribute("soql_query", query)
-            span.add_event("salesforce_query_start")
-            
-            # Execute the query
-            result = sf.query(query)
-            
-            span.add_event("salesforce_query_end")
-            span.set_attribute("record_count", len(result["records"]))
-            
-            # Clean up the records to make them more readable
-            records = []
-            for record in result["records"]:
-                # Remove attributes and null values
-                clean_record = {k: v for k, v in record.items() 
-                               if k != "attributes" and v is not None}
-                records.append(clean_record)
-            
-            return json.dumps({"accounts": records, "totalSize": result["totalSize"]})
+            return _run_fetch(span, query, limit, _ACCOUNTS_PREFIX, _clean_account)
         
         except Exception as e:
             span.record_exception(e)
             span.set_attribute("error", str(e))
-            return json.dumps({"error": str(e)})
+            return _dumps({"error": str(e)})
 
 def fetch_contacts(account_id: Optional[str] = None, 
                    limit: int = 10, 
@@ -89,59 +269,69 @@ def fetch_contacts(account_id: Optional[str] = None,
     Returns:
         JSON string with contact records
     """
-    with tracer.start_as_current_span("fetch_contacts") as span:
-        span.set_attribute("limit", limit)
-        if account_id:
-            span.set_attribute("account_id", account_id)
-        if name_filter:
-            span.set_attribute("name_filter", name_filter)
-        
+    attributes = {"limit": limit}
+    if account_id:
+        attributes["account_id"] = account_id
+    if name_filter:
+        attributes["name_filter"] = name_filter
+    
+    with _tracer().start_as_current_span("fetch_contacts", attributes=attributes) as span:
         try:
-            sf = connect_to_salesforce()
-            if not sf:
-                error_msg = "Failed to connect to Salesforce"
-                span.set_attribute("error", error_msg)
-                return json.dumps({"error": error_msg})
+            limit = int(limit)
             
             # Construct the query
-            query = "SELECT Id, FirstName, LastName, Email, Phone, Title, AccountId, Account.Name FROM Contact"
-            
             where_clauses = []
             if account_id:
-                where_clauses.append(f"AccountId = '{account_id}'")
+                where_clauses.append("AccountId = '" + _soql_escape(account_id) + "'")
             if name_filter:
-                where_clauses.append(f"(FirstName LIKE '%{name_filter}%' OR LastName LIKE '%{name_filter}%')")
+                pattern = "'%" + _soql_like(name_filter) + "%'"
+                where_clauses.append("(FirstName LIKE " + pattern + " OR LastName LIKE " + pattern + ")")
             
+            parts = [_CONTACT_SELECT]
             if where_clauses:
-                query += " WHERE " + " AND ".join(where_clauses)
-            
-            query += f" ORDER BY CreatedDate DESC LIMIT {limit}"
-            
-            span.set_attribute("soql_query", query)
-            span.add_event("salesforce_query_start")
+                parts.append(" WHERE " + " AND ".join(where_clauses))
+            parts.append(" ORDER BY CreatedDate DESC LIMIT {}".format(limit))
+            query = "".join(parts)
             
-            # Execute the query
-            result = sf.query(query)
-            
-            span.add_event("salesforce_query_end")
-            span.set_attribute("record_count", len(result["records"]))
+            return _run_fetch(span, query, limit, _CONTACTS_PREFIX, _clean_contact)
+        
+        except Exception as e:
+            span.record_exception(e)
+            span.set_attribute("error", str(e))
+            return _dumps({"error": str(e)})
+
+def fetch_accounts_with_contacts(limit: int = 10,
+                                 name_filter: Optional[str] = None,
+                                 contacts_per_account: int = 5) -> str:
+    """
+    Fetches accounts together with their most recent contacts in a single Salesforce query.
+    
+    Args:
+        limit: Maximum number of accounts to return
+        name_filter: Optional filter for account name (uses LIKE in SOQL)
+        contacts_per_account: Maximum number of contacts to return for each account
+        
+    Returns:
+        JSON string with account records, each with a Contacts list
+    """
+    attributes = {"limit": limit, "contacts_per_account": contacts_per_account}
+    if name_filter:
+        attributes["name_filter"] = name_filter
+    
+    with _tracer().start_as_current_span("fetch_accounts_with_contacts", attributes=attributes) as span:
+        try:
+            limit = int(limit)
             
-            # Clean up the records to make them more readable
-            records = []
-            for record in result["records"]:
-                # Handle the Account.Name relationship field
-                if "Account" in record and record["Account"]:
-                    record["AccountName"] = record["Account"]["Name"]
-                    del record["Account"]
-                
-                # Remove attributes and null values
-                clean_record = {k: v for k, v in record.items() 
-                               if k != "attributes" and v is not None}
-                records.append(clean_record)
+            # Construct the query
+            parts = [_ACCOUNT_WITH_CONTACTS_SELECT.format(int(contacts_per_account))]
+            if name_filter:
+                parts.append(" WHERE Name LIKE '%" + _soql_like(name_filter) + "%'")
+            parts.append(" ORDER BY CreatedDate DESC LIMIT {}".format(limit))
+            query = "".join(parts)
             
-            return json.dumps({"contacts": records, "totalSize": result["totalSize"]})
+            return _run_fetch(span, query, limit, _ACCOUNTS_PREFIX, _clean_account_with_contacts)
         
         except Exception as e:
             span.record_exception(e)
             span.set_attribute("error", str(e))
-            return json.dumps({"error": str(e)})
\ No newline at end of file
+            return _dumps({"error": str(e)})
\ No newline at end of file
@@ -1,14 +1,20 @@
 import os
+from contextlib import nullcontext
 from opentelemetry import trace
 from azure.monitor.opentelemetry import configure_azure_monitor
 from azure.ai.projects.telemetry.agents import AIAgentsInstrumentor
 
-def setup_tracing(project_client):
+# Shared no-op span context; nullcontext is stateless, so one instance can be reused
+_NULL_SPAN = nullcontext()
+
+def setup_tracing(project_client, enable_content_recording=False, sampling_ratio=1.0):
     """
     Set up Azure Monitor OpenTelemetry tracing for the Salesforce agent.
     
     Args:
         project_client: The Azure AI Project client
+        enable_content_recording: Whether to record full prompts and responses on agent spans
+        sampling_ratio: Fraction of traces to export to Application Insights
     
     Returns:
         The configured OpenTelemetry tracer
@@ -20,11 +26,14 @@ def setup_tracing(project_client):
         return trace.get_tracer(__name__)
     
     # Configure Azure Monitor with the connection string
-    configure_azure_monitor(connection_string=application_insights_connection_string)
+    configure_azure_monitor(
+        connection_string=application_insights_connection_string,
+        sampling_ratio=sampling_ratio
+    )
     
-    # Configure tracing
+    # Configure tracing; message content is only recorded when explicitly enabled
     instrumentor = AIAgentsInstrumentor()
-    instrumentor.instrument(enable_content_recording=True)
+    instrumentor.instrument(enable_content_recording=enable_content_recording)
     
     print("Azure Monitor tracing configured successfully")
     
@@ -42,18 +51,4 @@ def create_trace_span(name, tracer=None):
     Returns:
         A context manager for the span or a nullcontext if tracer is None
     """
-    if tracer:
-        return tracer.start_as_current_span(name)
-    else:
-        return nullcontext()
-
-# Helper context manager for when no tracer is provided
-class nullcontext:
-    def __init__(self, enter_result=None):
-        self.enter_result = enter_result
-
-    def __enter__(self):
-        return self.enter_result
-
-    def __exit__(self, *excinfo):
-        pass
\ No newline at end of file
+    return tracer.start_as_current_span(name) if tracer else _NULL_SPAN